@@ -1,30 +1,34 @@
 #!/usr/bin/env python3
 import os
 import re
-import json
+import sqlite3
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+import hashlib
+import functools
+from operator import attrgetter
 import logging
 import asyncio
+from datetime import timedelta
 import feedparser
-import requests
-from bs4 import BeautifulSoup
+import httpx
+import lxml.html
+from dotenv import load_dotenv
 import time
 
 from youtube_transcript_api import YouTubeTranscriptApi
 import google.generativeai as genai
 from telegram import Bot
+from telegram.error import RetryAfter
 from telegram.constants import ParseMode
-import nest_asyncio
-
-# Apply nest_asyncio to allow nested event loops (useful in notebooks or environments with running loops)
-nest_asyncio.apply()
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO)
 
-# Load sensitive credentials from environment variables
-if os.path.exists(".env"):
-    from dotenv import load_dotenv
-    load_dotenv()
+# Load sensitive credentials from environment variables (load_dotenv is a no-op without a .env file)
+load_dotenv()
 
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
@@ -36,26 +40,97 @@ if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID or not GEMINI_API_KEY:
 
 # Define constants
 HUBERMAN_RSS_FEED = "https://feeds.megaphone.fm/hubermanlab"
-LAST_EPISODE_FILE = "last_episode.txt"
+STATE_DB_FILE = "state.db"
+# Single-episode state file used before state.db, read once to seed a fresh database
+LEGACY_LAST_EPISODE_FILE = "last_episode.txt"
+# Episodes fetched, summarized or posted at the same time when catching up on a backlog
+MAX_CONCURRENT_EPISODES = 3
+LLM_CACHE_DIR = "llm_cache"
+
+# Transcripts longer than this (~8k tokens) are summarized chunk by chunk
+TRANSCRIPT_CHUNK_SIZE = 32000
+GEMINI_MAX_CONCURRENCY = 8
+CHUNK_SUMMARY_PROMPT = (
+    "Condense this part of a Huberman Lab podcast transcript. "
+    "Keep every protocol, mechanism, study and number that is mentioned.\n\n"
+)
+REDUCE_SUMMARY_PROMPT = "(The full transcript was too long and has been condensed into the consecutive parts below.)\n\n"
+
+HTTP_TIMEOUT = httpx.Timeout(10.0, connect=3.0)
+HTTP_LIMITS = httpx.Limits(max_connections=20)
+# Brotli is decoded by httpx when the brotli package is installed (httpx[brotli])
+ACCEPT_ENCODING = "br, gzip"
+YOUTUBE_TIMEDTEXT_URL = "https://www.youtube.com/api/timedtext"
+TELEGRAM_MAX_SEND_ATTEMPTS = 5
+
+# Precompiled patterns for video ID extraction and summary cleanup
+_EMBED_BYTES_RE = re.compile(rb"youtube(?:-nocookie)?\.com/embed/([A-Za-z0-9_-]{11})(?![A-Za-z0-9_-])")
+# Embed paths that look like video IDs but point at playlists or live channels
+_RESERVED_EMBED_IDS = {b"videoseries", b"live_stream"}
+_EMBED_RE = re.compile(r"/embed/([A-Za-z0-9_-]{11})")
+_VIDEO_ID_RE = re.compile(r"(?:v=|\/)([0-9A-Za-z_-]{11})")
+_MD_FENCE_RE = re.compile(r"```(?:markdown)?")
+_CAPTION_ANNOTATION_RE = re.compile(r"\[[^\]]*\]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Per-feed state: the validators for conditional GETs and the episodes already processed
+_DB = sqlite3.connect(STATE_DB_FILE, isolation_level=None)
+_DB.execute("CREATE TABLE IF NOT EXISTS feeds(url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT)")
+_DB.execute("CREATE TABLE IF NOT EXISTS episodes(feed_url TEXT, episode_id TEXT, PRIMARY KEY(feed_url, episode_id))")
 
 ytt_api = YouTubeTranscriptApi()
+genai.configure(api_key=GEMINI_API_KEY)
+# Shared so its connection pool is reused for every message part and episode
+_BOT = Bot(token=TELEGRAM_BOT_TOKEN)
+
+class PartiallyPostedError(Exception):
+    """
+    Raised when an episode fails after some of its message parts were already posted.
+    """
+
+# Summary cache statistics, logged after each lookup
+llm_cache_stats = {"hits": 0, "misses": 0}
+
+# Shared across episodes so batched summaries respect the Gemini rate limit as a whole
+gemini_semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+def create_http_client():
+    """
+    Creates the shared async HTTP client so feed and page fetches reuse pooled keep-alive connections.
+    """
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=HTTP_LIMITS, retries=3)
+    return httpx.AsyncClient(transport=transport, timeout=HTTP_TIMEOUT, follow_redirects=True)
+
+@functools.lru_cache(maxsize=4)
+def _get_model(name):
+    """
+    Returns a Gemini model instance, constructing it only once per model name.
+    """
+    return genai.GenerativeModel(name)
 
-def extract_youtube_video_id_from_url(site_url):
+async def extract_youtube_video_id_from_url(client, site_url):
     """
-    Given a Huberman Lab episode URL, fetch the page HTML,
-    parse its JSON‑LD structured data, and extract the YouTube video ID.
+    Given a Huberman Lab episode URL, fetch the page HTML and extract the YouTube video ID,
+    either from an embed URL in the raw HTML or from its JSON‑LD structured data.
     """
-    response = requests.get(site_url, verify = False)
+    response = await client.get(site_url, headers={"Accept-Encoding": ACCEPT_ENCODING})
     response.raise_for_status()
-    html_content = response.text
-    soup = BeautifulSoup(html_content, "html.parser")
+    logging.debug(f"Episode page content-encoding: {response.headers.get('content-encoding')}")
+
+    # Fast path: scan the raw bytes for a YouTube embed URL without building a DOM
+    for match in _EMBED_BYTES_RE.finditer(response.content):
+        if match.group(1) not in _RESERVED_EMBED_IDS:
+            return match.group(1).decode()
 
     # Look for JSON‑LD script tags
-    json_ld_tags = soup.find_all("script", type="application/ld+json")
+    # Plain strings (no smart_strings) so orjson accepts them
+    json_ld_tags = lxml.html.fromstring(response.content).xpath(
+        '//script[@type="application/ld+json"]/text()', smart_strings=False
+    )
     youtube_url = None
     for tag in json_ld_tags:
         try:
-            data = json.loads(tag.string)
+            data = _json.loads(tag)
             items = data if isinstance(data, list) else [data]
             for item in items:
                 if item.get("@type") == "VideoObject" and "embedUrl" in item:
@@ -68,56 +143,305 @@ def extract_youtube_video_id_from_url(site_url):
 
     if youtube_url:
         # Extract the 11-character video ID using regex
-        match = re.search(r"/embed/([A-Za-z0-9_-]{11})", youtube_url)
+        match = _EMBED_RE.search(youtube_url)
         if match:
             return match.group(1)
     return None
 
 
-def summarize_transcript(transcript, system_prompt, model = 'gemini-2.5-flash-lite'):
+def _summary_cache_key(transcript, system_prompt, model):
+    """
+    Returns the content-addressed cache key for a summary request.
+    """
+    return hashlib.sha256((model + system_prompt + transcript).encode()).hexdigest()
+
+def load_cached_summary(key):
+    """
+    Loads a cached summary, or returns None on a cache miss.
+    """
+    cache_path = os.path.join(LLM_CACHE_DIR, f"{key}.txt")
+    try:
+        with open(cache_path, "r") as f:
+            summary = f.read()
+        llm_cache_stats["hits"] += 1
+        logging.info(f"Summary cache hit ({llm_cache_stats})")
+        return summary
+    except FileNotFoundError:
+        llm_cache_stats["misses"] += 1
+        logging.info(f"Summary cache miss ({llm_cache_stats})")
+        return None
+
+def save_cached_summary(key, summary):
+    """
+    Saves a summary to the cache.
+    """
+    # Write to a temporary file first so a crash never leaves a partial cache entry
+    os.makedirs(LLM_CACHE_DIR, exist_ok=True)
+    cache_path = os.path.join(LLM_CACHE_DIR, f"{key}.txt")
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(summary)
+    os.replace(tmp_path, cache_path)
+
+def split_transcript(transcript, max_length=TRANSCRIPT_CHUNK_SIZE):
+    """
+    Splits a transcript into chunks of at most max_length characters, preferring sentence boundaries.
     """
-    Summarizes the provided transcript using the Google Gemini model.
+    chunks = []
+    start, end = 0, len(transcript)
+    while end - start > max_length:
+        split_index = transcript.rfind(". ", start, start + max_length) + 1  # Try to split after a sentence
+        if split_index <= start:  # If no sentence end, split at the last word
+            split_index = transcript.rfind(" ", start, start + max_length)
+        if split_index <= start:  # If no space either, split at max_length
+            split_index = start + max_length
+
+        chunks.append(transcript[start:split_index].strip())
+        start = split_index
+        while start < end and transcript[start].isspace():  # Skip whitespace before the next chunk
+            start += 1
+
+    chunks.append(transcript[start:])  # Add last chunk
+    return chunks
+
+async def _summarize_chunk(chunk, model):
     """
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel(model)
-    prompt = (
-        system_prompt +
-        transcript 
+    Condenses one transcript chunk, limiting the number of concurrent Gemini requests.
+    """
+    async with gemini_semaphore:
+        response = await _get_model(model).generate_content_async(
+            CHUNK_SUMMARY_PROMPT + chunk, generation_config={"temperature": 0}
+        )
+    return response.text.strip()
+
+def start_summary_stream(transcript, system_prompt, model = 'gemini-2.5-flash-lite'):
+    """
+    Starts summarizing the provided transcript with the Google Gemini model in a background task.
+    Returns the queue the summary text is put on as it is generated, and the task.
+    """
+    queue = asyncio.Queue()
+    task = asyncio.create_task(_generate_summary(queue, transcript, system_prompt, model))
+    return queue, task
+
+async def _generate_summary(queue, transcript, system_prompt, model):
+    """
+    Puts the summary text on the queue as it is generated, then None, or the exception if generation fails.
+    Transcripts too long for a single call are first condensed chunk by chunk (map-reduce).
+    Summaries are cached on disk by model, prompt and transcript, so reprocessing an episode skips the API calls.
+    """
+    try:
+        key = _summary_cache_key(transcript, system_prompt, model)
+        summary = load_cached_summary(key)
+        if summary is not None:
+            queue.put_nowait(summary)
+        else:
+            if len(transcript) <= TRANSCRIPT_CHUNK_SIZE:
+                prompt = (
+                    system_prompt +
+                    transcript
+                )
+            else:
+                chunks = split_transcript(transcript)
+                logging.info(f"Summarizing transcript in {len(chunks)} chunks.")
+                chunk_summaries = await asyncio.gather(*(_summarize_chunk(chunk, model) for chunk in chunks))
+                prompt = (
+                    system_prompt +
+                    REDUCE_SUMMARY_PROMPT +
+                    "\n\n".join(chunk_summaries)
+                )
+
+            pieces = []
+            # The queue is unbounded, so the Gemini slot is released as soon as generation ends,
+            # however long posting the text takes
+            async with gemini_semaphore:
+                # Deterministic generation keeps cached summaries equivalent to fresh ones
+                response = await _get_model(model).generate_content_async(
+                    prompt, generation_config={"temperature": 0}, stream=True
+                )
+                async for chunk in response:
+                    pieces.append(chunk.text)
+                    queue.put_nowait(chunk.text)
+            save_cached_summary(key, "".join(pieces).strip())
+    except Exception as e:
+        queue.put_nowait(e)
+    else:
+        queue.put_nowait(None)  # End of the summary
+
+async def iter_summary_stream(queue):
+    """
+    Yields the summary text from a queue filled by start_summary_stream, re-raising a failed generation.
+    """
+    while (piece := await queue.get()) is not None:
+        if isinstance(piece, Exception):
+            raise piece
+        yield piece
+
+
+def load_feed_cache(feed_url=HUBERMAN_RSS_FEED):
+    """
+    Loads the ETag and Last-Modified headers from the previous fetch of a feed.
+    """
+    row = _DB.execute("SELECT etag, last_modified FROM feeds WHERE url = ?", (feed_url,)).fetchone()
+    if row is None:
+        return {}
+    return {"etag": row[0], "last_modified": row[1]}
+
+
+def save_feed_cache(etag, last_modified, feed_url=HUBERMAN_RSS_FEED):
+    """
+    Saves the ETag and Last-Modified headers for the next conditional GET of a feed.
+    """
+    _DB.execute(
+        "INSERT INTO feeds(url, etag, last_modified) VALUES (?, ?, ?) "
+        "ON CONFLICT(url) DO UPDATE SET etag = excluded.etag, last_modified = excluded.last_modified",
+        (feed_url, etag, last_modified),
     )
-    response = model.generate_content(prompt)
-    summary = response.text.strip()
-    return summary
 
-def check_new_episode():
+
+def get_episode_id(entry):
     """
-    Parses the Huberman Lab RSS feed and returns the latest entry and its identifier.
+    Returns the identifier of a feed entry.
     """
-    feed = feedparser.parse(HUBERMAN_RSS_FEED)
+    # Use 'yt_videoid' if available; otherwise, fall back to the 'id' field.
+    return entry.get("yt_videoid", entry.get("id"))
+
+
+async def check_new_episodes(client):
+    """
+    Fetches the Huberman Lab RSS feed with a conditional GET and returns the unprocessed entries, newest first,
+    together with the feed's ETag and Last-Modified headers. Returns no entries if the feed has not changed
+    since the last fetch. The headers are only saved here when there is nothing to process; otherwise the caller
+    saves them once every entry has been posted, so unprocessed entries are never hidden behind a 304.
+    """
+    cache = load_feed_cache()
+    headers = {"Accept-Encoding": ACCEPT_ENCODING}
+    if cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
+
+    response = await client.get(HUBERMAN_RSS_FEED, headers=headers)
+    if response.status_code == 304:
+        logging.info("Feed not modified since last fetch.")
+        return [], None
+    response.raise_for_status()
+
+    feed = feedparser.parse(response.content)
+    validators = (response.headers.get("ETag"), response.headers.get("Last-Modified"))
     if not feed.entries:
         logging.info("No entries found in feed.")
-        return None, None
-    latest_entry = feed.entries[0]
-    # Use 'yt_videoid' if available; otherwise, fall back to the 'id' field.
-    latest_id = latest_entry.get("yt_videoid", latest_entry.get("id"))
-    return latest_entry, latest_id
+        return [], None
+    seen = load_seen_episode_ids()
+    if not seen:
+        seed_seen_episode_ids(feed.entries)
+        seen = load_seen_episode_ids()
+    entries = [entry for entry in feed.entries if get_episode_id(entry) not in seen]
+    if not entries:
+        save_feed_cache(*validators)
+    return entries, validators
+
+
+def load_seen_episode_ids(feed_url=HUBERMAN_RSS_FEED):
+    """
+    Loads the IDs of all processed episodes of a feed.
+    """
+    rows = _DB.execute("SELECT episode_id FROM episodes WHERE feed_url = ?", (feed_url,))
+    return {row[0] for row in rows}
 
 
-def load_last_episode_id():
+def seed_seen_episode_ids(entries, feed_url=HUBERMAN_RSS_FEED):
     """
-    Loads the ID of the last processed episode from a file.
+    Marks the already posted entries of a feed as processed when the state database is fresh.
+    The episode recorded in the legacy last_episode.txt and every older entry count as posted.
+    Without that file, every entry except the newest counts as posted.
     """
-    if os.path.exists(LAST_EPISODE_FILE):
-        with open(LAST_EPISODE_FILE, "r") as f:
-            return f.read().strip()
-    return None
+    episode_ids = [get_episode_id(entry) for entry in entries]
+    try:
+        with open(LEGACY_LAST_EPISODE_FILE, "r") as f:
+            last_episode_id = f.read().strip()
+    except FileNotFoundError:
+        last_episode_id = None
+
+    if last_episode_id in episode_ids:
+        logging.info(f"Seeding processed episodes from {LEGACY_LAST_EPISODE_FILE}.")
+        seen_ids = episode_ids[episode_ids.index(last_episode_id):]
+    else:
+        logging.info("Fresh state database, only the newest episode will be processed.")
+        seen_ids = episode_ids[1:]
+    for episode_id in seen_ids:
+        save_episode_id(episode_id, feed_url)
 
 
-def save_last_episode_id(episode_id):
+def save_episode_id(episode_id, feed_url=HUBERMAN_RSS_FEED):
     """
-    Saves the latest episode ID to file for future checks.
+    Marks an episode of a feed as processed for future checks.
     """
-    with open(LAST_EPISODE_FILE, "w") as f:
-        f.write(episode_id)
+    _DB.execute(
+        "INSERT OR IGNORE INTO episodes(feed_url, episode_id) VALUES (?, ?)",
+        (feed_url, episode_id),
+    )
+
+async def get_youtube_transcript(client, video_id):
+    """
+    Fetches the English transcript of a YouTube video and joins it into a single string.
+    Tries the timedtext endpoint directly first and falls back to youtube_transcript_api.
+    """
+    try:
+        transcript = await fetch_timedtext_transcript(client, video_id)
+    except Exception as e:
+        logging.info(f"Direct timedtext fetch failed, falling back to the transcript API: {e}")
+        # The transcript client is blocking, so run it off the event loop
+        transcript = await asyncio.to_thread(fetch_api_transcript, video_id)
+    return _clean_transcript(transcript)
+
+async def fetch_timedtext_transcript(client, video_id):
+    """
+    Fetches English captions in a single request to YouTube's timedtext endpoint (json3 format).
+    """
+    response = await client.get(YOUTUBE_TIMEDTEXT_URL, params={"v": video_id, "lang": "en", "fmt": "json3"})
+    response.raise_for_status()
+    events = response.json()["events"]
+    # Segments within an event carry their own spacing, separate events (cues) do not
+    transcript = " ".join("".join(seg["utf8"] for seg in event.get("segs", [])) for event in events)
+    if not transcript.strip():
+        raise ValueError("Empty timedtext transcript.")
+    return transcript
+
+def fetch_api_transcript(video_id):
+    """
+    Fetches English captions through youtube_transcript_api.
+    """
+    try:
+        transcript_list = ytt_api.fetch(video_id, languages=['en'])
+        return " ".join(map(attrgetter("text"), transcript_list.snippets))
+    except Exception as e:
+        raise ValueError(f"Error fetching transcript: {e}")
+
+def _clean_transcript(transcript):
+    """
+    Removes caption annotations like [Music] and repeated phrases to cut the tokens sent to Gemini.
+    """
+    transcript = _CAPTION_ANNOTATION_RE.sub("", transcript)
+    transcript = _WHITESPACE_RE.sub(" ", transcript)
+    return _dedupe_consecutive_ngrams(transcript, n=5).strip()
+
+def _dedupe_consecutive_ngrams(text, n=5, max_n=20):
+    """
+    Drops any phrase of n to max_n words that immediately repeats the preceding words,
+    as produced by overlapping YouTube auto-caption segments.
+    """
+    words = text.split(" ")
+    result = []
+    i = 0
+    while i < len(words):
+        for k in range(n, min(max_n, len(result)) + 1):
+            if result[-k] == words[i] and words[i:i + k] == result[-k:]:
+                i += k  # Skip the repeated phrase
+                break
+        else:
+            result.append(words[i])
+            i += 1
+    return " ".join(result)
 
 def extract_video_id(url):
     """
@@ -125,48 +449,92 @@ def extract_video_id(url):
     Note: This is a basic implementation and may not cover all URL formats.
     """
     # Try to match the standard URL format.
-    match = re.search(r"(?:v=|\/)([0-9A-Za-z_-]{11})", url)
+    match = _VIDEO_ID_RE.search(url)
     if match:
         return match.group(1)
     else:
         raise ValueError("Invalid YouTube URL or unable to extract video ID.")
 
-async def post_to_telegram(summary, title, youtube_link):
+async def _warmup_bot():
     """
-    Posts the episode title, YouTube link, and summary to the Telegram channel.
-    Automatically splits the message if it's longer than 4096 characters.
+    Opens the shared Telegram bot's connection to api.telegram.org.
     """
-    bot = Bot(token=TELEGRAM_BOT_TOKEN)
+    await _BOT.initialize()
 
+async def post_to_telegram(summary_stream, title, youtube_link, max_length=4096):
+    """
+    Posts the episode title, YouTube link, and summary to the Telegram channel.
+    The summary is consumed as it is generated, and every complete part of up to 4096 characters
+    is sent right away. Returns the full cleaned summary.
+    Raises PartiallyPostedError if posting fails after some parts are already in the channel.
+    """
     # Construct the main message
     message = (
         f"*New Huberman Lab Episode:* {title}\n"
         f"[Watch here]({youtube_link})\n\n"
-        f"*Summary:*\n{summary}"
+        f"*Summary:*\n"
     )
-    
-    # Split long messages
-    message_parts = split_message(message)
-
-    # Send messages one by one
-    for part in message_parts:
-        await bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=part, parse_mode="Markdown")
-        await asyncio.sleep(1)  # Prevent rate-limiting
+    pieces = []
+    posted_parts = 0
+    try:
+        async for piece in summary_stream:
+            pieces.append(piece)
+            message += piece
+            if len(message) > max_length:
+                # Send the complete parts and keep the remainder for the next chunks
+                *message_parts, message = split_message(message, max_length)
+                for part in message_parts:
+                    if await send_message_part(part):
+                        posted_parts += 1
+
+        for part in split_message(message, max_length):
+            if await send_message_part(part):
+                posted_parts += 1
+    except Exception as e:
+        if posted_parts:
+            raise PartiallyPostedError(f"{posted_parts} message part(s) already posted: {e}") from e
+        raise
+    return clean_summary("".join(pieces))
+
+async def send_message_part(part):
+    """
+    Sends one message part to the Telegram channel, returning whether anything was sent.
+    Waits only when Telegram's flood control asks for it, then resends the part, up to
+    TELEGRAM_MAX_SEND_ATTEMPTS times.
+    """
+    part = clean_summary(part)
+    if not part:
+        return False
+    for attempt in range(1, TELEGRAM_MAX_SEND_ATTEMPTS + 1):
+        try:
+            await _BOT.send_message(chat_id=TELEGRAM_CHAT_ID, text=part, parse_mode="Markdown")
+            return True
+        except RetryAfter as e:
+            if attempt == TELEGRAM_MAX_SEND_ATTEMPTS:
+                raise
+            retry_after = e.retry_after
+            if isinstance(retry_after, timedelta):  # Newer python-telegram-bot versions
+                retry_after = retry_after.total_seconds()
+            logging.info(f"Telegram flood control hit, retrying in {retry_after} seconds.")
+            await asyncio.sleep(retry_after)
 
 def split_message(message, max_length=4096):
     """
     Splits a long message into smaller chunks without breaking words or formatting.
     """
     parts = []
-    while len(message) > max_length:
-        split_index = message[:max_length].rfind("\n")  # Try to split at newline
-        if split_index == -1:  # If no newline, split at max_length
-            split_index = max_length
-        
-        parts.append(message[:split_index].strip())
-        message = message[split_index:].strip()  # Remove sent part
-
-    parts.append(message)  # Add last chunk
+    start, end = 0, len(message)
+    while end - start > max_length:
+        split_index = message.rfind("\n", start, start + max_length)  # Try to split at newline
+        if split_index <= start:  # If no newline, split at max_length
+            split_index = start + max_length
+
+        parts.append(message[start:split_index].strip())
+        start = split_index
+        while start < end and message[start].isspace():  # Skip whitespace before the next chunk
+            start += 1
+
+    parts.append(message[start:])  # Add last chunk
     return parts
 
 def clean_summary(summary):
@@ -174,48 +542,101 @@ def clean_summary(summary):
     Cleans up the summary by removing unnecessary characters and tags.
     """
     # Remove "```html" and "```" from the beginning and end of the summary
-    summary = re.sub(r"```markdown", "", summary)
-    summary = re.sub(r"```", "", summary)
+    summary = _MD_FENCE_RE.sub("", summary)
     summary = summary.strip()
     return summary
 
 
 async def main():
-    episode, latest_id = check_new_episode()
-    if episode is None:
-        logging.info("No episode found in the RSS feed.")
+    async with create_http_client() as client:
+        await process_feed(client)
 
-    last_episode_id = load_last_episode_id()
-    if latest_id == last_episode_id:
+
+async def process_feed(client):
+    """
+    Checks the Huberman Lab feed and summarizes every new episode concurrently.
+    Episodes are posted one at a time, oldest first, so their messages never interleave in the channel.
+    """
+    episodes, validators = await check_new_episodes(client)
+    if not episodes:
         logging.info("No new episode found.")
-        #return
-    else:
-        logging.info("New episode found!")
-        save_last_episode_id(latest_id)
+        return
+    logging.info(f"{len(episodes)} new episode(s) found!")
+    episodes = episodes[::-1]  # The feed lists the newest episode first
+
+    with open("system_prompt.txt", "r") as file:
+        system_prompt = file.read()
+
+    # Connect to Telegram while the episodes are fetched
+    bot_task = asyncio.create_task(_warmup_bot())
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_EPISODES)
+    # Set once an episode is done posting (or has failed), letting the next one post
+    posted = [asyncio.Event() for _ in episodes]
+
+    async def process(index, episode):
+        # Bounds the whole episode, from page fetch to last post. Episodes acquire it in posting order,
+        # so an episode waiting for its turn never blocks the predecessor it waits for.
+        async with semaphore:
+            try:
+                youtube_link, queue, generation = await prepare_episode(client, episode, system_prompt)
+                try:
+                    if index:
+                        await posted[index - 1].wait()
+                    await bot_task
+                    # Parts are posted while Gemini is still generating the rest of the summary
+                    cleaned_summary = await post_to_telegram(iter_summary_stream(queue), episode.title, youtube_link)
+                except PartiallyPostedError:
+                    # Retrying would post the episode again on top of the parts already in the channel
+                    save_episode_id(get_episode_id(episode))
+                    raise
+                finally:
+                    generation.cancel()  # Stop generating if posting failed; no-op once it has finished
+                # Record the post right away so nothing that fails later can make the next run repost it
+                save_episode_id(get_episode_id(episode))
+                print(cleaned_summary)
+            finally:
+                if index:
+                    # An episode that failed early must still wait, or the next one would overtake its predecessor
+                    await posted[index - 1].wait()
+                posted[index].set()
+
+    try:
+        results = await asyncio.gather(*(process(i, episode) for i, episode in enumerate(episodes)), return_exceptions=True)
+    finally:
+        await asyncio.gather(bot_task, return_exceptions=True)
+        await _BOT.shutdown()
+
+    failed = False
+    for episode, result in zip(episodes, results):
+        if isinstance(result, PartiallyPostedError):
+            logging.error(f"Episode {episode.title} was only partially posted: {result}")
+        elif isinstance(result, Exception):
+            logging.error(f"Failed to process episode {episode.title}: {result}")
+            failed = True
+    if not failed:
+        # Only now is it safe for the next run to skip an unchanged feed
+        save_feed_cache(*validators)
+
+
+async def prepare_episode(client, episode, system_prompt):
+    """
+    Fetches the transcript of a single episode and starts summarizing it.
+    Returns the YouTube link and the summary queue and task from start_summary_stream.
+    """
     # The episode link from the RSS feed points to the Huberman Lab page.
     page_url = episode.link
-    title = episode.title
 
     # Extract the YouTube video ID from the episode page
-    youtube_video_id = extract_youtube_video_id_from_url(page_url)
+    youtube_video_id = await extract_youtube_video_id_from_url(client, page_url)
     #youtube_video_id = "c9JmHOUp6VU"
     if youtube_video_id is None:
         raise ValueError("No YouTube video found on the page.")
     else:
         # Build a standard YouTube watch URL from the video ID
         youtube_link = f"https://www.youtube.com/watch?v={youtube_video_id}"
-        try:
-            transcript_list = ytt_api.fetch(youtube_video_id, languages=['en'])
-            transcript = " ".join(entry.text for entry in transcript_list.snippets)
-        except Exception as e:
-            raise ValueError(f"Error fetching transcript: {e}")
-
-        with open("system_prompt.txt", "r") as file:
-            system_prompt = file.read()
-        summary = summarize_transcript(transcript, system_prompt)
-        cleaned_summary = clean_summary(summary)
-        print(cleaned_summary)
-        await post_to_telegram(cleaned_summary, title, youtube_link)
+        transcript = await get_youtube_transcript(client, youtube_video_id)
+        queue, generation = start_summary_stream(transcript, system_prompt)
+        return youtube_link, queue, generation
 
 
 if __name__ == "__main__":